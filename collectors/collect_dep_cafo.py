@@ -19,15 +19,16 @@ multiple approaches.
 """
 
 import re
-import time
 import json
+import codecs
 from datetime import datetime
-from typing import List, Dict, Optional
-import requests
-from bs4 import BeautifulSoup
+from functools import lru_cache
+from typing import List, Dict, Optional, Iterable, Iterator
 
 from config import REQUEST_DELAY_SECONDS, USER_AGENT, PA_POULTRY_COUNTIES
-from db import get_db
+
+# requests, bs4 and db (supabase) are imported inside the functions that
+# use them, so the parsing helpers can be imported without that cost
 
 SOURCE_NAME = 'PA DEP CAFO Permits'
 
@@ -37,6 +38,37 @@ CAFO_REPORT_URL = 'http://cedatareporting.pa.gov/ReportServer/Pages/ReportViewer
 # Alternative: Use the PA Bulletin which publishes permit applications/renewals
 PA_BULLETIN_SEARCH = 'https://www.pacodeandbulletin.gov/Search'
 
+# CSV export columns we read, in the order parse_csv_report unpacks them
+CSV_COLUMNS = (
+    'PERMIT NO',
+    'PRIMARY FACILITY NAME',
+    'CLIENT NAME',
+    'COUNTY',
+    'MUNICIPALITY',
+    'AEU',
+)
+CSV_ANIMAL_TYPE_COLUMN = 'Animal Type'
+
+# Read size when streaming report downloads (requests defaults to 512 bytes)
+STREAM_CHUNK_SIZE = 65536
+
+_POULTRY_RE = re.compile('poultry|chicken|layer|broiler|turkey|pullet', re.IGNORECASE)
+
+# Keywords that identify an integrator in free text (lowercase -> display name)
+INTEGRATORS_MAP = {
+    'bell & evans': 'Bell & Evans',
+    'bell and evans': 'Bell & Evans',
+    'perdue': 'Perdue',
+    'tyson': 'Tyson',
+    'pilgrim': "Pilgrim's Pride",
+    'koch': 'Koch Foods',
+    'wenger': 'Wenger Feeds',
+}
+
+# Longest keywords checked first, so a longer brand string wins over a shorter
+# key it contains no matter where it sits in the dict (ties keep dict order)
+_INTEGRATOR_PAIRS = tuple(sorted(INTEGRATORS_MAP.items(), key=lambda kv: -len(kv[0])))
+
 
 def parse_aeu(aeu_str: str) -> Optional[float]:
     """Parse AEU string like '1,166.25' to float."""
@@ -48,8 +80,12 @@ def parse_aeu(aeu_str: str) -> Optional[float]:
         return None
 
 
+@lru_cache(maxsize=256)
 def detect_operation_type(text: str) -> str:
-    """Detect type of poultry operation from description text."""
+    """
+    Detect type of poultry operation from description text.
+    Cached: the CSV report repeats a handful of Animal Type values.
+    """
     text = text.lower()
     if 'layer' in text or 'egg' in text:
         return 'layer'
@@ -67,16 +103,7 @@ def detect_operation_type(text: str) -> str:
 def detect_integrator(text: str) -> Optional[str]:
     """Try to detect the integrator from text."""
     text = text.lower()
-    integrators = {
-        'bell & evans': 'Bell & Evans',
-        'bell and evans': 'Bell & Evans',
-        'perdue': 'Perdue',
-        'tyson': 'Tyson',
-        'pilgrim': "Pilgrim's Pride",
-        'koch': 'Koch Foods',
-        'wenger': 'Wenger Feeds',
-    }
-    for key, value in integrators.items():
+    for key, value in _INTEGRATOR_PAIRS:
         if key in text:
             return value
     return None
@@ -109,11 +136,16 @@ def scrape_pa_bulletin_cafo_notices() -> List[Dict]:
     return farms
 
 
-def fetch_cafo_report_csv() -> Optional[str]:
+def fetch_cafo_report_csv() -> Optional[Iterator[str]]:
     """
     Try to fetch the CAFO report in CSV format.
     The SSRS report can export to CSV if we construct the right URL.
+    
+    Returns an iterator over the CSV lines, streamed from the response
+    so parsing starts before the download finishes.
     """
+    import requests
+    
     # SSRS reports can be exported by adding format parameter
     # This URL structure may need adjustment
     csv_url = (
@@ -123,39 +155,68 @@ def fetch_cafo_report_csv() -> Optional[str]:
         '&rs:Format=CSV'
     )
     
-    headers = {'User-Agent': USER_AGENT}
+    # Ask for a compressed transfer; requests decompresses as we read
+    headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'}
     
     try:
-        response = requests.get(csv_url, headers=headers, timeout=60)
+        # stream=True: the content-type check below only needs the headers
+        response = requests.get(csv_url, headers=headers, timeout=60, stream=True)
         if response.status_code == 200 and 'text/csv' in response.headers.get('content-type', ''):
-            return response.text
+            return iter_response_lines(response)
+        response.close()
     except Exception as e:
         print(f"CSV fetch failed: {e}")
     
     return None
 
 
-def parse_csv_report(csv_text: str) -> List[Dict]:
+def iter_response_lines(response) -> Iterator[str]:
+    """
+    Yield decoded lines from a streamed response, closing it when done.
+    SSRS exports UTF-8; decoding explicitly avoids charset detection.
+    """
+    with response:
+        lines = response.iter_lines(chunk_size=STREAM_CHUNK_SIZE)
+        yield from codecs.iterdecode(lines, 'utf-8-sig', errors='replace')
+
+
+def parse_csv_report(lines: Iterable[str]) -> List[Dict]:
     """Parse the CSV export of the CAFO report."""
     import csv
-    from io import StringIO
     
     farms = []
-    reader = csv.DictReader(StringIO(csv_text))
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if not header:
+        return farms
+    
+    # Resolve column positions once rather than building a dict per row
+    positions = {name.strip(): i for i, name in enumerate(header)}
+    indexes = [positions.get(name) for name in CSV_COLUMNS]
+    animal_type_index = positions.get(CSV_ANIMAL_TYPE_COLUMN)
+    if animal_type_index is None:
+        print(f"CSV report has no '{CSV_ANIMAL_TYPE_COLUMN}' column")
+        return farms
     
     for row in reader:
-        # Filter for poultry operations
-        animal_type = row.get('Animal Type', '').lower()
-        if not any(x in animal_type for x in ['poultry', 'chicken', 'layer', 'broiler', 'turkey', 'pullet']):
+        # Filter for poultry operations before touching the other columns
+        if animal_type_index >= len(row):
+            continue
+        animal_type = row[animal_type_index]
+        if not _POULTRY_RE.search(animal_type):
             continue
         
+        permit_no, facility_name, client_name, county, municipality, aeu = [
+            row[i] if i is not None and i < len(row) else '' for i in indexes
+        ]
+        
         farm = {
-            'external_id': row.get('PERMIT NO', '').strip(),
-            'name': row.get('PRIMARY FACILITY NAME', '').strip(),
-            'owner_name': row.get('CLIENT NAME', '').strip(),
-            'county': row.get('COUNTY', '').strip(),
-            'city': row.get('MUNICIPALITY', '').strip(),
-            'animal_equivalent_units': parse_aeu(row.get('AEU', '')),
+            'external_id': permit_no.strip(),
+            'name': facility_name.strip(),
+            'owner_name': client_name.strip(),
+            'county': county.strip(),
+            'city': municipality.strip(),
+            'animal_equivalent_units': parse_aeu(aeu),
             'operation_type': detect_operation_type(animal_type),
         }
         
@@ -169,6 +230,9 @@ def scrape_dep_cafo_html() -> List[Dict]:
     Scrape the HTML version of the CAFO report.
     This is messier but more reliable than CSV.
     """
+    import requests
+    from bs4 import BeautifulSoup
+    
     farms = []
     headers = {'User-Agent': USER_AGENT}
     
@@ -186,7 +250,9 @@ def scrape_dep_cafo_html() -> List[Dict]:
             print(f"Failed to fetch report: {response.status_code}")
             return farms
         
-        soup = BeautifulSoup(response.text, 'html.parser')
+        # Hand lxml the raw bytes; it reads the charset itself, skipping
+        # requests' charset detection pass over the whole report
+        soup = BeautifulSoup(response.content, 'lxml')
         
         # Find all table rows
         tables = soup.find_all('table')
@@ -243,6 +309,19 @@ def get_known_pa_poultry_permits() -> List[Dict]:
     return known_farms
 
 
+# Roof estimate inputs by operation type: (birds per AEU, birds per house, sqft per house)
+ROOF_ESTIMATE_FACTORS = {
+    # Layers: roughly 250 birds per AEU, ~100,000 per house, house is ~36,000 sqft
+    'layer': (250, 100000, 36000),
+    # Broilers: roughly 167 birds per AEU, ~25,000 per house, house is ~20,000 sqft
+    'broiler': (167, 25000, 20000),
+    'poultry': (167, 25000, 20000),
+    # Turkeys: larger birds, fewer per house (rough estimate of 200 AEU per house)
+    'turkey': (1, 200, 25000),
+}
+DEFAULT_ROOF_SQFT_PER_AEU = 50  # rough average
+
+
 def estimate_roof_size(aeu: float, operation_type: str) -> Optional[int]:
     """
     Estimate roof square footage based on AEU and operation type.
@@ -260,27 +339,21 @@ def estimate_roof_size(aeu: float, operation_type: str) -> Optional[int]:
     if not aeu:
         return None
     
-    if operation_type == 'layer':
-        # Layers: roughly 250 birds per AEU, ~100,000 per house, house is ~36,000 sqft
-        estimated_birds = aeu * 250
-        estimated_houses = estimated_birds / 100000
-        return int(estimated_houses * 36000)
-    elif operation_type in ['broiler', 'poultry']:
-        # Broilers: roughly 167 birds per AEU, ~25,000 per house, house is ~20,000 sqft
-        estimated_birds = aeu * 167
-        estimated_houses = estimated_birds / 25000
-        return int(estimated_houses * 20000)
-    elif operation_type == 'turkey':
-        # Turkeys: larger birds, fewer per house
-        estimated_houses = aeu / 200  # rough estimate
-        return int(estimated_houses * 25000)
+    factors = ROOF_ESTIMATE_FACTORS.get(operation_type)
+    if factors is None:
+        return int(aeu * DEFAULT_ROOF_SQFT_PER_AEU)
     
-    # Default estimate
-    return int(aeu * 50)  # rough average
+    # Same order of operations as the per-type formulas, so results match exactly
+    birds_per_aeu, birds_per_house, sqft_per_house = factors
+    estimated_houses = aeu * birds_per_aeu / birds_per_house
+    return int(estimated_houses * sqft_per_house)
 
 
 def collect():
     """Main collection function."""
+    import requests
+    from db import get_db
+    
     db = get_db()
     run_id = db.start_run(SOURCE_NAME, {'method': 'multi-source'})
     
@@ -292,10 +365,15 @@ def collect():
     try:
         # Try CSV export first
         print("Attempting CSV export...")
-        csv_data = fetch_cafo_report_csv()
-        if csv_data:
-            farms_found = parse_csv_report(csv_data)
-            print(f"Found {len(farms_found)} poultry farms in CSV")
+        csv_lines = fetch_cafo_report_csv()
+        if csv_lines:
+            # The body downloads while it is parsed, so errors can surface here
+            try:
+                farms_found = parse_csv_report(csv_lines)
+                print(f"Found {len(farms_found)} poultry farms in CSV")
+            except requests.RequestException as e:
+                print(f"CSV download failed: {e}")
+                farms_found = []
         
         # If CSV failed, try HTML
         if not farms_found:
@@ -309,7 +387,9 @@ def collect():
             farms_found = get_known_pa_poultry_permits()
             print(f"Using {len(farms_found)} known farms")
         
-        # Process each farm
+        # Prepare each farm for the database
+        rows = []
+        external_ids = []
         for farm_data in farms_found:
             # Add estimated roof size
             if farm_data.get('animal_equivalent_units'):
@@ -321,22 +401,18 @@ def collect():
             # Set default state
             farm_data['state'] = 'PA'
             
-            # Upsert to database
-            external_id = farm_data.pop('external_id', f"unknown-{farm_data.get('name', 'farm')}")
-            farm_id, is_new = db.upsert_farm(
-                farm_data,
-                SOURCE_NAME,
-                external_id,
-                raw_data=farm_data.copy()
-            )
-            
+            external_ids.append(farm_data.pop('external_id', f"unknown-{farm_data.get('name', 'farm')}"))
+            rows.append(farm_data)
+        
+        # Upsert to database in one batch (rows double as the raw record)
+        results = db.bulk_upsert_farms(rows, SOURCE_NAME, external_ids, raw_data=rows)
+        
+        for farm_data, (farm_id, is_new) in zip(rows, results):
             if is_new:
                 records_new += 1
                 print(f"  NEW: {farm_data.get('name')} ({farm_data.get('county')} Co.)")
             else:
                 records_updated += 1
-            
-            time.sleep(0.1)  # Brief pause
         
         # Refresh lead scores
         print("Refreshing lead scores...")
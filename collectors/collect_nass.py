@@ -17,16 +17,64 @@ API Documentation: https://quickstats.nass.usda.gov/api
 Free API key required - get one at the link above.
 """
 
-import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from operator import itemgetter
 from typing import List, Dict, Optional
 import requests
 
-from config import NASS_API_KEY, PA_POULTRY_COUNTIES, REQUEST_DELAY_SECONDS
+try:
+    import orjson  # Optional: much faster decoding of large NASS responses
+except ImportError:
+    orjson = None
+
+from config import NASS_API_KEY, PA_POULTRY_COUNTIES
 from db import get_db
 
 SOURCE_NAME = 'USDA NASS Census'
 BASE_URL = 'https://quickstats.nass.usda.gov/api/api_GET/'
 
+# Max NASS queries in flight at once (e.g. several census years)
+MAX_CONCURRENT_QUERIES = 4
+
+# Shared session so NASS queries reuse keep-alive connections
+SESSION = requests.Session()
+
+# (substring of commodity_desc, county stats key), checked in order
+COMMODITY_CATEGORIES = (
+    ('broiler', 'broilers'),
+    ('layer', 'layers'),
+    ('egg', 'layers'),
+    ('turkey', 'turkeys'),
+)
+
+record_fields = itemgetter('county_name', 'Value', 'commodity_desc')
+
+
+@lru_cache(maxsize=256)
+def commodity_category(commodity: str) -> str:
+    """
+    Map a NASS commodity_desc to its county stats key.
+    Cached: a census pull repeats a few dozen commodities across thousands of records.
+    """
+    commodity = commodity.lower()
+    for substring, key in COMMODITY_CATEGORIES:
+        if substring in commodity:
+            return key
+    return 'other_poultry'
+
+
+def parse_nass_value(value: str) -> Optional[int]:
+    """
+    Parse a NASS Value like '1,234' to int.
+    Returns None for withheld values ('(D)' avoids disclosing individual data).
+    """
+    try:
+        return int(value.replace(',', ''))
+    except ValueError:
+        return None
+
 
 def query_nass(params: dict) -> Optional[List[dict]]:
     """
@@ -39,13 +87,13 @@ def query_nass(params: dict) -> Optional[List[dict]]:
     params['format'] = 'JSON'
     
     try:
-        response = requests.get(BASE_URL, params=params, timeout=60)
+        response = SESSION.get(BASE_URL, params=params, timeout=60)
         if response.status_code != 200:
             print(f"NASS API error: {response.status_code}")
             print(response.text[:500])
             return None
         
-        data = response.json()
+        data = orjson.loads(response.content) if orjson else response.json()
         return data.get('data', [])
     
     except Exception as e:
@@ -53,6 +101,16 @@ def query_nass(params: dict) -> Optional[List[dict]]:
         return None
 
 
+def query_nass_many(param_sets: List[dict]) -> List[Optional[List[dict]]]:
+    """
+    Run several independent NASS queries concurrently.
+    Returns one result per parameter set, in the same order.
+    """
+    workers = min(MAX_CONCURRENT_QUERIES, len(param_sets)) or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(query_nass, param_sets))
+
+
 def get_pa_poultry_stats() -> List[dict]:
     """
     Get Pennsylvania poultry statistics by county.
@@ -70,75 +128,55 @@ def get_pa_poultry_stats() -> List[dict]:
         'state_alpha': 'PA',
         'agg_level_desc': 'COUNTY',
         'year': '2022',  # Most recent census
+        # Only county totals; the size-class breakdowns ("INVENTORY OF LAYERS:
+        # (1 TO 49 HEAD)" etc.) repeat the same birds and dominate the payload
+        'domain_desc': 'TOTAL',
     }
     
-    # Get inventory data (number of birds)
+    # Inventory data (number of birds)
     inventory_params = params.copy()
     inventory_params['statisticcat_desc'] = 'INVENTORY'
     
-    print("Fetching PA poultry inventory data...")
-    inventory_data = query_nass(inventory_params)
+    # Number of operations
+    operations_params = params.copy()
+    operations_params['statisticcat_desc'] = 'OPERATIONS'
+    
+    print("Fetching PA poultry inventory and operations data...")
+    inventory_data, operations_data = query_nass_many([inventory_params, operations_params])
     
     if inventory_data:
         print(f"  Found {len(inventory_data)} inventory records")
         
         # Process by county
-        county_stats = {}
+        county_stats = defaultdict(lambda: {
+            'total_birds': 0,
+            'broilers': 0,
+            'layers': 0,
+            'turkeys': 0,
+            'other_poultry': 0,
+        })
         for record in inventory_data:
-            county = record.get('county_name', '').title()
-            if county not in county_stats:
-                county_stats[county] = {
-                    'county': county,
-                    'total_birds': 0,
-                    'broilers': 0,
-                    'layers': 0,
-                    'turkeys': 0,
-                    'other_poultry': 0,
-                }
+            county, value, commodity = record_fields(record)
+            stats = county_stats[county]
+            
+            count = parse_nass_value(value)
+            if count is None:
+                continue
             
-            value = record.get('Value', '').replace(',', '')
-            if value and value != '(D)':  # (D) = withheld to avoid disclosing individual data
-                try:
-                    count = int(value)
-                    commodity = record.get('commodity_desc', '').lower()
-                    
-                    if 'broiler' in commodity:
-                        county_stats[county]['broilers'] += count
-                    elif 'layer' in commodity or 'egg' in commodity:
-                        county_stats[county]['layers'] += count
-                    elif 'turkey' in commodity:
-                        county_stats[county]['turkeys'] += count
-                    else:
-                        county_stats[county]['other_poultry'] += count
-                    
-                    county_stats[county]['total_birds'] += count
-                except ValueError:
-                    pass
+            stats[commodity_category(commodity)] += count
+            stats['total_birds'] += count
         
-        results = list(county_stats.values())
-    
-    time.sleep(REQUEST_DELAY_SECONDS)
-    
-    # Get number of operations
-    operations_params = params.copy()
-    operations_params['statisticcat_desc'] = 'OPERATIONS'
-    
-    print("Fetching PA poultry operations data...")
-    operations_data = query_nass(operations_params)
+        results = [{'county': county.title(), **stats} for county, stats in county_stats.items()]
     
     if operations_data:
         print(f"  Found {len(operations_data)} operations records")
         
         # Add operations count to county stats
-        ops_by_county = {}
+        ops_by_county = defaultdict(int)
         for record in operations_data:
-            county = record.get('county_name', '').title()
-            value = record.get('Value', '').replace(',', '')
-            if value and value != '(D)':
-                try:
-                    ops_by_county[county] = ops_by_county.get(county, 0) + int(value)
-                except ValueError:
-                    pass
+            count = parse_nass_value(record['Value'])
+            if count is not None:
+                ops_by_county[record['county_name'].title()] += count
         
         for result in results:
             result['num_operations'] = ops_by_county.get(result['county'], 0)
@@ -147,7 +185,7 @@ def get_pa_poultry_stats() -> List[dict]:
 
 
 def get_county_rankings(stats: List[dict]) -> List[dict]:
-    """Rank counties by poultry production."""
+    """Rank all counties by poultry production."""
     # Sort by total birds
     sorted_stats = sorted(stats, key=lambda x: x.get('total_birds', 0), reverse=True)
     
@@ -211,8 +249,10 @@ def collect():
         
         # Store results as notes for reference
         # In a production system, you might store this in a separate table
-        total_ops = sum(s.get('num_operations', 0) for s in stats)
-        total_birds = sum(s.get('total_birds', 0) for s in stats)
+        total_ops = total_birds = 0
+        for stat in stats:
+            total_ops += stat.get('num_operations', 0)
+            total_birds += stat.get('total_birds', 0)
         
         print(f"\nPA Totals:")
         print(f"  Operations: {total_ops:,}")
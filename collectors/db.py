@@ -6,8 +6,8 @@ Uses the supabase-py library.
 Install: pip install supabase
 """
 
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Tuple
 import json
 
 try:
@@ -18,21 +18,44 @@ except ImportError:
 
 from config import SUPABASE_URL, SUPABASE_KEY
 
+# Max rows sent to PostgREST in one bulk request
+BULK_CHUNK_SIZE = 500
+
+# Values per in.(...) filter when looking rows up by key. These go in the
+# GET query string, so keep it well below BULK_CHUNK_SIZE to avoid 414s
+LOOKUP_CHUNK_SIZE = 100
+
+# Rows fetched per request when reading whole tables (PostgREST's default max)
+PAGE_SIZE = 1000
+
+
+def chunked(items: list, size: int = BULK_CHUNK_SIZE):
+    """Yield successive slices of at most `size` items."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
 
 class LeadDB:
     """Database helper for chicken farm leads."""
     
     def __init__(self):
         self.client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        self._source_ids = self.load_source_ids()
     
     # ============================================
     # DATA SOURCE MANAGEMENT
     # ============================================
     
+    def load_source_ids(self) -> Dict[str, int]:
+        """Fetch the whole (small) data_sources table as {name: id}."""
+        result = self.client.table('data_sources').select('id,name').execute()
+        return {row['name']: row['id'] for row in result.data}
+    
     def get_source_id(self, source_name: str) -> int:
-        """Get the ID of a data source by name."""
-        result = self.client.table('data_sources').select('id').eq('name', source_name).single().execute()
-        return result.data['id']
+        """Get the ID of a data source by name (cached, refreshed once on a miss)."""
+        if source_name not in self._source_ids:
+            self._source_ids = self.load_source_ids()
+        return self._source_ids[source_name]
     
     def start_run(self, source_name: str, metadata: dict = None) -> int:
         """Start a data collection run. Returns run_id."""
@@ -46,23 +69,14 @@ class LeadDB:
     
     def complete_run(self, run_id: int, records_found: int, records_new: int, 
                      records_updated: int, error: str = None):
-        """Mark a run as complete."""
-        status = 'failed' if error else 'success'
-        self.client.table('data_runs').update({
-            'completed_at': datetime.utcnow().isoformat(),
-            'status': status,
-            'records_found': records_found,
-            'records_new': records_new,
-            'records_updated': records_updated,
-            'error_message': error
-        }).eq('id', run_id).execute()
-        
-        # Update last successful run on source
-        if not error:
-            source_id = self.client.table('data_runs').select('source_id').eq('id', run_id).single().execute().data['source_id']
-            self.client.table('data_sources').update({
-                'last_successful_run': datetime.utcnow().isoformat()
-            }).eq('id', source_id).execute()
+        """Mark a run as complete (and its source as last run OK, if no error)."""
+        self.client.rpc('complete_run', {
+            'p_run_id': run_id,
+            'p_records_found': records_found,
+            'p_records_new': records_new,
+            'p_records_updated': records_updated,
+            'p_error': error or None
+        }).execute()
     
     # ============================================
     # FARM OPERATIONS
@@ -74,90 +88,199 @@ class LeadDB:
         Insert or update a farm record.
         Returns (farm_id, is_new).
         
-        Deduplication strategy:
+        Deduplication strategy (in the upsert_farm SQL function, one round trip):
         1. Try to match by external_id + source
         2. Try to match by name + county (fuzzy)
         3. If no match, insert new
         """
+        result = self.client.rpc('upsert_farm', {
+            'p_farm_data': farm_data,
+            'p_source_id': self.get_source_id(source_name),
+            'p_external_id': external_id,
+            'p_raw_data': raw_data
+        }).execute()
+        row = result.data[0]
+        return row['farm_id'], row['is_new']
+    
+    def bulk_upsert_farms(self, rows: List[dict], source_name: str,
+                          external_ids: List[str],
+                          raw_data: List[dict] = None) -> List[Tuple[int, bool]]:
+        """
+        Insert or update many farm records in a handful of requests.
+        Returns [(farm_id, is_new), ...] in the same order as rows.
+        Neither rows nor raw_data are modified, so they may be the same dicts.
+        
+        Same deduplication strategy as calling upsert_farm once per row,
+        but each step is resolved for the whole batch at once:
+        1. Match by external_id + source
+        2. Match by name + county (lowest id if several match)
+        3. Insert the rest, merging rows of the batch that match an
+           earlier new row by external_id or name + county
+        """
         source_id = self.get_source_id(source_name)
+        if raw_data is None:
+            raw_data = [None] * len(rows)
+        now = datetime.now(timezone.utc).isoformat()
         
-        # Check if we already have this farm from this source
-        existing = self.client.table('farm_sources')\
-            .select('farm_id')\
-            .eq('source_id', source_id)\
-            .eq('external_id', external_id)\
-            .execute()
+        # Farms we already have from this source
+        existing = self.select_in('farm_sources', 'farm_id,external_id', 'external_id',
+                                  set(external_ids), source_id=source_id)
+        farm_by_external_id = {r['external_id']: r['farm_id'] for r in existing}
         
-        if existing.data:
-            # Update existing farm
-            farm_id = existing.data[0]['farm_id']
-            self.client.table('farms').update(farm_data).eq('id', farm_id).execute()
-            
-            # Update last_seen in farm_sources
-            self.client.table('farm_sources').update({
-                'last_seen': datetime.utcnow().isoformat(),
-                'raw_data': raw_data
-            }).eq('farm_id', farm_id).eq('source_id', source_id).execute()
-            
-            return farm_id, False
+        # Find the rest by name + county
+        names = {
+            row['name'] for row, external_id in zip(rows, external_ids)
+            if external_id not in farm_by_external_id and row.get('name') and row.get('county')
+        }
+        existing = self.select_in('farms', 'id,name,county', 'name', names)
+        farm_by_name = {}
+        for r in sorted(existing, key=lambda r: r['id']):
+            # Oldest farm wins if several share a name + county (as in upsert_farm)
+            farm_by_name.setdefault((r['name'], r['county']), r['id'])
         
-        # Try to find by name + county
-        if farm_data.get('name') and farm_data.get('county'):
-            existing = self.client.table('farms')\
-                .select('id')\
-                .eq('name', farm_data['name'])\
-                .eq('county', farm_data['county'])\
-                .execute()
-            
-            if existing.data:
-                farm_id = existing.data[0]['id']
-                # Merge data (don't overwrite existing good data with nulls)
-                update_data = {k: v for k, v in farm_data.items() if v is not None}
-                self.client.table('farms').update(update_data).eq('id', farm_id).execute()
-                
-                # Link this source to the farm
-                self.client.table('farm_sources').upsert({
-                    'farm_id': farm_id,
-                    'source_id': source_id,
-                    'external_id': external_id,
-                    'raw_data': raw_data,
-                    'last_seen': datetime.utcnow().isoformat()
-                }).execute()
-                
-                return farm_id, False
+        results = [None] * len(rows)
+        updates = {}  # farm_id -> merged row for farms already in the database
+        pending = {}  # external_id of its first row -> merged row for a new farm
+        pending_by_external_id = {}
+        pending_by_name = {}
+        new_results = []  # (index, pending key, is_new), resolved after the insert
+        for i, (row, external_id) in enumerate(zip(rows, external_ids)):
+            name_key = (row['name'], row['county']) if row.get('name') and row.get('county') else None
+            # Merge data (don't overwrite existing good data with nulls)
+            merge = {k: v for k, v in row.items() if v is not None}
+            if external_id in farm_by_external_id:
+                farm_id = farm_by_external_id[external_id]
+                updates[farm_id] = {**updates.get(farm_id, {}), **row, 'id': farm_id}
+            elif name_key in farm_by_name:
+                farm_id = farm_by_name[name_key]
+                updates[farm_id] = {**updates.get(farm_id, {}), **merge, 'id': farm_id}
+            else:
+                # Rows earlier in this batch that will be inserted count as
+                # existing farms too, just as with one upsert_farm per row
+                if external_id in pending_by_external_id:
+                    key = pending_by_external_id[external_id]
+                    pending[key].update(row)
+                    new_results.append((i, key, False))
+                elif name_key in pending_by_name:
+                    key = pending_by_name[name_key]
+                    pending[key].update(merge)
+                    pending_by_external_id[external_id] = key
+                    new_results.append((i, key, False))
+                else:
+                    key = external_id
+                    pending[key] = dict(row)
+                    pending_by_external_id[external_id] = key
+                    if name_key:
+                        pending_by_name[name_key] = key
+                    new_results.append((i, key, True))
+                continue
+            results[i] = (farm_id, False)
         
-        # Insert new farm
-        farm_data['external_id'] = external_id
-        result = self.client.table('farms').insert(farm_data).execute()
-        farm_id = result.data[0]['id']
+        # Update existing farms
+        self.write_in_chunks('farms', list(updates.values()), upsert=True)
         
-        # Link source
-        self.client.table('farm_sources').insert({
-            'farm_id': farm_id,
-            'source_id': source_id,
-            'external_id': external_id,
-            'raw_data': raw_data
-        }).execute()
+        # Insert new farms, each tagged with the external_id of its first row
+        new_rows = [{**row, 'external_id': key} for key, row in pending.items()]
+        inserted = self.write_in_chunks('farms', new_rows)
+        new_ids = {record['external_id']: record['id'] for record in inserted}
+        for i, key, is_new in new_results:
+            results[i] = (new_ids[key], is_new)
         
-        return farm_id, True
+        # Link every farm to this source
+        links = {}
+        for (farm_id, _), external_id, raw in zip(results, external_ids, raw_data):
+            links[farm_id] = {
+                'farm_id': farm_id,
+                'source_id': source_id,
+                'external_id': external_id,
+                'raw_data': raw,
+                'last_seen': now
+            }
+        for chunk in chunked(list(links.values())):
+            self.client.table('farm_sources').upsert(chunk, on_conflict='farm_id,source_id').execute()
+        
+        return results
+    
+    def select_in(self, table: str, columns: str, column: str, values: Iterable[str],
+                  **filters) -> List[dict]:
+        """
+        Select rows whose `column` is one of `values` (and each of `filters`
+        equals its value), LOOKUP_CHUNK_SIZE values per request.
+        
+        postgrest-py can't quote values containing " or \\ inside in.(...),
+        so those few are looked up one at a time with eq instead.
+        """
+        def query():
+            q = self.client.table(table).select(columns)
+            for name, value in filters.items():
+                q = q.eq(name, value)
+            return q
+        
+        listable = [v for v in values if '"' not in v and '\\' not in v]
+        found = []
+        for chunk in chunked(listable, LOOKUP_CHUNK_SIZE):
+            found.extend(query().in_(column, chunk).execute().data)
+        for value in set(values).difference(listable):
+            found.extend(query().eq(column, value).execute().data)
+        return found
+    
+    def write_in_chunks(self, table: str, rows: List[dict], upsert: bool = False) -> List[dict]:
+        """
+        Insert (or upsert) rows in chunks of BULK_CHUNK_SIZE.
+        Returns the written records. PostgREST doesn't promise they come
+        back in payload order, so callers must match them to rows by key.
+        
+        PostgREST sets columns missing from a bulk payload to NULL, so rows
+        are grouped by column set and each group is written separately.
+        """
+        groups = {}
+        for row in rows:
+            groups.setdefault(frozenset(row), []).append(row)
+        
+        written = []
+        for group in groups.values():
+            for chunk in chunked(group):
+                query = self.client.table(table)
+                query = query.upsert(chunk) if upsert else query.insert(chunk)
+                written.extend(query.execute().data)
+        return written
     
     def get_farm(self, farm_id: int) -> Optional[dict]:
         """Get a single farm by ID."""
         result = self.client.table('farms').select('*').eq('id', farm_id).single().execute()
         return result.data
     
+    def iter_farm_pages(self, page_size: int = PAGE_SIZE) -> Iterator[List[dict]]:
+        """
+        Yield every farm, best leads first, one page of rows at a time.
+        Stops on an empty page rather than a short one: the project's "Max
+        rows" setting may cap pages below page_size.
+        """
+        offset = 0
+        while True:
+            result = self.client.table('farms')\
+                .select('*')\
+                .order('lead_score', desc=True)\
+                .order('id')\
+                .range(offset, offset + page_size - 1)\
+                .execute()
+            if not result.data:
+                return
+            yield result.data
+            offset += len(result.data)
+    
     def get_farms_by_status(self, status: str) -> List[dict]:
         """Get all farms with a given lead status."""
         result = self.client.table('farms').select('*').eq('lead_status', status).execute()
         return result.data
     
     def get_farms_needing_enrichment(self, limit: int = 100) -> List[dict]:
-        """Get farms that need contact/property enrichment."""
-        result = self.client.table('farms')\
+        """
+        Get active farms still missing a phone number, best leads first,
+        with their last_contact time (see sql/005_enrichment_queue.sql).
+        """
+        result = self.client.table('v_farms_enrichment_queue')\
             .select('*')\
-            .is_('phone', 'null')\
-            .is_('email', 'null')\
-            .eq('is_active', True)\
             .order('lead_score', desc=True)\
             .limit(limit)\
             .execute()
@@ -212,6 +335,10 @@ class LeadDB:
             'created_by': created_by
         }).execute()
     
+    def add_notes(self, notes: List[dict]):
+        """Add many notes at once (dicts with farm_id, note, note_type, ...)."""
+        self.write_in_chunks('farm_notes', notes)
+    
     def get_today_followups(self) -> List[dict]:
         """Get farms that need follow-up today."""
         result = self.client.rpc('v_today_followups').execute()
@@ -236,16 +363,12 @@ class LeadDB:
     
     def get_stats(self) -> dict:
         """Get summary statistics."""
-        total = self.client.table('farms').select('id', count='exact').execute()
-        by_status = self.client.table('farms').select('lead_status').execute()
-        
-        status_counts = {}
-        for row in by_status.data:
-            status = row['lead_status']
-            status_counts[status] = status_counts.get(status, 0) + 1
+        by_status = self.client.rpc('stats_by_status').execute()
+        status_counts = {row['status']: row['n'] for row in by_status.data}
         
         return {
-            'total_farms': total.count,
+            # Every farm falls in exactly one status group (NULL included)
+            'total_farms': sum(status_counts.values()),
             'by_status': status_counts
         }
 
@@ -254,7 +377,11 @@ class LeadDB:
 _db = None
 
 def get_db() -> LeadDB:
-    """Get database instance."""
+    """
+    Get database instance.
+    Use this rather than create_client so every module in a process shares
+    one Supabase client and its keep-alive connection pool.
+    """
     global _db
     if _db is None:
         _db = LeadDB()
@@ -9,12 +9,20 @@ import time
 import random
 import argparse
 import os
-from urllib.parse import quote_plus
-from typing import Optional, Tuple, List
+import threading
+import hashlib
+import sqlite3
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import quote_plus, urlparse
+from typing import Optional, Tuple, List, Dict
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
 
-from supabase import create_client
+from db import get_db
 
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
@@ -22,21 +30,53 @@ SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 REQUEST_DELAY_MIN = 2
 REQUEST_DELAY_MAX = 5
 
+# Farms searched concurrently; requests to the same host are still spaced out
+ENRICH_WORKERS = 4
+
+# Shared across workers so repeat hosts reuse pooled keep-alive connections
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=Retry(total=2, backoff_factor=0.5))
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+# On-disk cache of fetched pages, so re-runs over the same farms skip the network
+CACHE_PATH = os.getenv('ENRICH_CACHE_PATH', 'enrich_cache.sqlite')
+CACHE_MAX_AGE_SECONDS = 14 * 24 * 3600  # contact pages change slowly
+
 USER_AGENTS = [
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36',
     'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36',
 ]
 
-PHONE_PATTERNS = [
-    r'\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}',
-    r'\d{3}[-.\s]\d{3}[-.\s]\d{4}',
-]
+PHONE_PATTERN = r'\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}'
 
 EMAIL_PATTERN = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
 
+# Both patterns in one regex so a page is scanned once. Email comes first so
+# digits inside an address aren't also picked up as a phone number.
+CONTACT_RE = re.compile(f'(?P<email>{EMAIL_PATTERN})|(?P<phone>{PHONE_PATTERN})')
+
+# Pages without an '@' can't hold an email, so skip trying that branch at every word
+PHONE_RE = re.compile(f'(?P<phone>{PHONE_PATTERN})')
+
+
+# Earliest time (time.monotonic) each host may be requested again
+_next_request_at: Dict[str, float] = {}
+_next_request_lock = threading.Lock()
+
 
-def random_delay():
-    time.sleep(random.uniform(REQUEST_DELAY_MIN, REQUEST_DELAY_MAX))
+def polite_delay(url: str):
+    """
+    Wait for this URL's host to be free. Requests to the same host are
+    spaced REQUEST_DELAY_MIN-MAX seconds apart across all workers, while
+    requests to other hosts go ahead without waiting.
+    """
+    host = urlparse(url).netloc
+    with _next_request_lock:
+        now = time.monotonic()
+        slot = max(now, _next_request_at.get(host, now))
+        _next_request_at[host] = slot + random.uniform(REQUEST_DELAY_MIN, REQUEST_DELAY_MAX)
+    time.sleep(slot - now)
 
 
 def get_headers():
@@ -47,6 +87,41 @@ def get_headers():
     }
 
 
+def open_cache() -> sqlite3.Connection:
+    conn = sqlite3.connect(CACHE_PATH, timeout=30)
+    conn.execute('CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, fetched_at REAL, body BLOB)')
+    return conn
+
+
+def http_get(url: str, timeout: int) -> Optional[bytes]:
+    """
+    GET a URL and return the body of a 200 response, else None.
+    Bodies are cached on disk (keyed by sha256 of the URL) for
+    CACHE_MAX_AGE_SECONDS; only real network requests wait on polite_delay().
+    """
+    key = hashlib.sha256(url.encode()).hexdigest()
+    with closing(open_cache()) as conn:
+        row = conn.execute(
+            'SELECT body FROM pages WHERE key = ? AND fetched_at > ?',
+            (key, time.time() - CACHE_MAX_AGE_SECONDS)
+        ).fetchone()
+    if row:
+        return row[0]
+    
+    polite_delay(url)
+    response = SESSION.get(url, headers=get_headers(), timeout=timeout)
+    if response.status_code != 200:
+        return None
+    
+    with closing(open_cache()) as conn, conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO pages (key, fetched_at, body) VALUES (?, ?, ?)',
+            (key, time.time(), response.content)
+        )
+    return response.content
+
+
+@lru_cache(maxsize=4096)
 def clean_phone(phone: str) -> str:
     digits = re.sub(r'\D', '', phone)
     if len(digits) == 11 and digits.startswith('1'):
@@ -56,48 +131,62 @@ def clean_phone(phone: str) -> str:
     return phone
 
 
-def extract_phones(text: str) -> List[str]:
+def extract_contacts(text: str) -> Tuple[List[str], List[str]]:
+    """Find phone numbers and emails in a single pass. Returns (phones, emails)."""
     phones = []
-    for pattern in PHONE_PATTERNS:
-        matches = re.findall(pattern, text)
-        for match in matches:
-            cleaned = clean_phone(match)
-            if cleaned not in phones:
-                phones.append(cleaned)
-    return phones
+    emails = []
+    pattern = CONTACT_RE if '@' in text else PHONE_RE
+    for match in pattern.finditer(text):
+        if match.lastgroup == 'phone':
+            phones.append(clean_phone(match.group()))
+        else:
+            email = match.group().lower()
+            if not any(x in email for x in ['example.com', 'domain.com']):
+                emails.append(email)
+    # dict.fromkeys dedupes in first-seen order
+    return list(dict.fromkeys(phones)), list(dict.fromkeys(emails))
 
 
-def extract_emails(text: str) -> List[str]:
-    emails = re.findall(EMAIL_PATTERN, text.lower())
-    filtered = []
-    for email in emails:
-        if not any(x in email for x in ['example.com', 'domain.com', '.png', '.jpg']):
-            if email not in filtered:
-                filtered.append(email)
-    return filtered
+# Only anchors are needed from a SERP; skip building the rest of the tree
+RESULT_LINKS = SoupStrainer('a')
 
 
 def search_duckduckgo(query: str) -> List[str]:
     urls = []
     search_url = f"https://html.duckduckgo.com/html/?q={quote_plus(query)}"
     try:
-        response = requests.get(search_url, headers=get_headers(), timeout=15)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
+        html = http_get(search_url, timeout=15)
+        if html:
+            soup = BeautifulSoup(html, 'lxml', parse_only=RESULT_LINKS)
             for link in soup.select('.result__a'):
                 href = link.get('href', '')
                 if href and href.startswith('http'):
                     urls.append(href)
     except Exception as e:
-        print(f"    Search error: {e}")
+        # Runs on a worker thread, so name the query rather than rely on position
+        print(f"    Search error ({query}): {e}")
     return urls[:5]
 
 
+def page_text(html: bytes) -> str:
+    """
+    Reduce a page to its visible text plus mailto:/tel: link targets.
+    Scripts, styles and markup can't hold real contact info, and skipping
+    them keeps asset names like logo@2x.png out of the email results.
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    for tag in soup(['script', 'style', 'noscript', 'template']):
+        tag.decompose()
+    links = [a['href'].split(':', 1)[1] for a in soup.select('a[href^="mailto:"], a[href^="tel:"]')]
+    return ' '.join([soup.get_text(' ', strip=True)] + links)
+
+
 def fetch_page(url: str) -> Optional[str]:
+    """Fetch a page and return its contact-relevant text."""
     try:
-        response = requests.get(url, headers=get_headers(), timeout=10)
-        if response.status_code == 200:
-            return response.text
+        html = http_get(url, timeout=10)
+        if html:
+            return page_text(html)
     except:
         pass
     return None
@@ -112,25 +201,20 @@ def find_contact_info(farm_name: str, owner_name: str, city: str, county: str) -
         f'{farm_name} {county} county Pennsylvania',
     ]
     
-    print(f"    Searching for: {farm_name}")
-    
     for query in queries:
         urls = search_duckduckgo(query)
         if urls:
             break
-        random_delay()
     
     for url in urls[:3]:
         content = fetch_page(url)
         if not content:
             continue
         
-        phones = extract_phones(content)
-        emails = extract_emails(content)
+        phones, emails = extract_contacts(content)
         
         if phones and not phone:
             phone = phones[0]
-            print(f"      Found phone: {phone}")
         
         if emails and not email:
             for e in emails:
@@ -139,17 +223,23 @@ def find_contact_info(farm_name: str, owner_name: str, city: str, county: str) -
                     break
             if not email and emails:
                 email = emails[0]
-            if email:
-                print(f"      Found email: {email}")
         
         if phone and email:
             break
-        
-        random_delay()
     
     return phone, email
 
 
+def enrich_farm(farm: dict) -> Tuple[Optional[str], Optional[str]]:
+    """Look up contact info for one farm record. Runs on a worker thread."""
+    return find_contact_info(
+        farm.get('name', ''),
+        farm.get('owner_name', ''),
+        farm.get('city', ''),
+        farm.get('county', '')
+    )
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--limit', type=int, default=10)
@@ -159,46 +249,38 @@ def main():
         print("Error: SUPABASE_URL and SUPABASE_KEY required")
         return
     
-    client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    # Shared client (and its pooled connections) from db.get_db
+    db = get_db()
     
     # Get farms missing contact info, prioritized by lead_score
-    result = client.table('farms')\
-        .select('*')\
-        .is_('phone', 'null')\
-        .eq('is_active', True)\
-        .order('lead_score', desc=True)\
-        .limit(args.limit)\
-        .execute()
-    
-    farms = result.data
+    farms = db.get_farms_needing_enrichment(args.limit)
     print(f"Found {len(farms)} farms to enrich\n")
     
+    # Searching is almost all network wait, so overlap several farms.
+    # Results come back in order and each is saved as soon as it's ready,
+    # so an interrupted run keeps what it already found.
     enriched = 0
-    for i, farm in enumerate(farms, 1):
-        print(f"[{i}/{len(farms)}] {farm['name']} ({farm.get('city', '?')}, {farm.get('county', '?')} Co.)")
-        
-        phone, email = find_contact_info(
-            farm.get('name', ''),
-            farm.get('owner_name', ''),
-            farm.get('city', ''),
-            farm.get('county', '')
-        )
-        
-        updates = {}
-        if phone:
-            updates['phone'] = phone
-        if email:
-            updates['email'] = email
-        
-        if updates:
-            client.table('farms').update(updates).eq('id', farm['id']).execute()
-            enriched += 1
-            print(f"    ✓ Updated")
-        else:
-            print(f"    ✗ No contact info found")
-        
-        print()
-        random_delay()
+    with ThreadPoolExecutor(max_workers=ENRICH_WORKERS) as executor:
+        results = executor.map(enrich_farm, farms)
+        for i, (farm, (phone, email)) in enumerate(zip(farms, results), 1):
+            print(f"[{i}/{len(farms)}] {farm['name']} ({farm.get('city', '?')}, {farm.get('county', '?')} Co.)")
+            
+            updates = {}
+            if phone:
+                updates['phone'] = phone
+                print(f"    Found phone: {phone}")
+            if email:
+                updates['email'] = email
+                print(f"    Found email: {email}")
+            
+            if updates:
+                db.update_farm(farm['id'], updates)
+                enriched += 1
+                print(f"    ✓ Updated")
+            else:
+                print(f"    ✗ No contact info found")
+            
+            print()
     
     print(f"\nDone: {enriched}/{len(farms)} farms enriched")
 
@@ -16,12 +16,27 @@ Usage:
 
 import sys
 import csv
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Tuple
 
-from db import get_db
+from db import get_db, BULK_CHUNK_SIZE
 
 SOURCE_NAME = 'Manual Research'
 
+# Farm field -> accepted CSV column names, in order of preference
+CSV_COLUMN_ALIASES = {
+    'owner_name': ('owner_name', 'owner'),
+    'phone': ('phone',),
+    'email': ('email',),
+    'address_line1': ('address', 'address_line1'),
+    'city': ('city',),
+    'zip': ('zip', 'zip_code'),
+    'operation_type': ('operation_type', 'type'),
+    'integrator': ('integrator',),
+    'animal_equivalent_units': ('aeu', 'animal_equivalent_units'),
+    'estimated_houses': ('houses', 'estimated_houses'),
+}
+
 
 def add_farm_interactive():
     """Interactive prompts to add a farm."""
@@ -81,7 +96,7 @@ def add_farm_interactive():
         'animal_equivalent_units': aeu,
         'estimated_houses': houses,
         'data_confidence': 0.8,  # Manual research is usually pretty good
-        'last_verified': datetime.utcnow().isoformat(),
+        'last_verified': datetime.now(timezone.utc).isoformat(),
     }
     
     # Estimate roof if we have houses
@@ -139,68 +154,115 @@ def import_csv(filepath: str):
         
         count_new = 0
         count_updated = 0
+        batch = []
+        
+        # Resolve aliases against the header once rather than probing every row
+        columns = {
+            field: [c for c in aliases if c in (reader.fieldnames or ())]
+            for field, aliases in CSV_COLUMN_ALIASES.items()
+        }
         
         for row in reader:
-            # Map CSV columns to database fields
-            farm_data = {
-                'name': row.get('name', '').strip(),
-                'county': row.get('county', '').strip(),
-                'state': 'PA',
-                'owner_name': row.get('owner_name') or row.get('owner') or None,
-                'phone': row.get('phone') or None,
-                'email': row.get('email') or None,
-                'address_line1': row.get('address') or row.get('address_line1') or None,
-                'city': row.get('city') or None,
-                'zip': row.get('zip') or row.get('zip_code') or None,
-                'operation_type': row.get('operation_type') or row.get('type') or 'poultry',
-                'integrator': row.get('integrator') or None,
-                'data_confidence': 0.7,
-            }
+            farm_data = row_to_farm(row, columns)
             
             # Skip if missing required fields
             if not farm_data['name'] or not farm_data['county']:
                 print(f"Skipping row - missing name or county: {row}")
                 continue
             
-            # Parse numeric fields
-            aeu = row.get('aeu') or row.get('animal_equivalent_units')
-            if aeu:
-                try:
-                    farm_data['animal_equivalent_units'] = float(aeu)
-                except ValueError:
-                    pass
-            
-            houses = row.get('houses') or row.get('estimated_houses')
-            if houses:
-                try:
-                    farm_data['estimated_houses'] = int(houses)
-                    farm_data['estimated_roof_sqft'] = int(houses) * 25000
-                except ValueError:
-                    pass
-            
-            # Save
             external_id = f"csv-{farm_data['name'].lower().replace(' ', '-')}"
-            farm_id, is_new = db.upsert_farm(
-                farm_data,
-                SOURCE_NAME,
-                external_id,
-                raw_data=dict(row)
-            )
+            batch.append((farm_data, external_id, row))
             
-            # Add notes if present
-            notes = row.get('notes')
-            if notes:
-                db.add_note(farm_id, notes, note_type='research')
-            
-            if is_new:
-                count_new += 1
-                print(f"  NEW: {farm_data['name']}")
-            else:
-                count_updated += 1
+            # Save in batches
+            if len(batch) >= BULK_CHUNK_SIZE:
+                new, updated = save_import_batch(db, batch)
+                count_new += new
+                count_updated += updated
+                batch = []
+        
+        if batch:
+            new, updated = save_import_batch(db, batch)
+            count_new += new
+            count_updated += updated
         
         print(f"\nImport complete: {count_new} new, {count_updated} updated")
 
 
+def row_to_farm(row: dict, columns: dict) -> dict:
+    """
+    Map one CSV row to farm fields. columns maps each field to the alias
+    columns present in the file; the first non-empty one wins.
+    """
+    def first(field):
+        for column in columns[field]:
+            if row[column]:
+                return row[column]
+        return None
+    
+    farm_data = {
+        'name': (row.get('name') or '').strip(),
+        'county': (row.get('county') or '').strip(),
+        'state': 'PA',
+        'owner_name': first('owner_name'),
+        'phone': first('phone'),
+        'email': first('email'),
+        'address_line1': first('address_line1'),
+        'city': first('city'),
+        'zip': first('zip'),
+        'operation_type': first('operation_type') or 'poultry',
+        'integrator': first('integrator'),
+        'data_confidence': 0.7,
+    }
+    
+    # Parse numeric fields
+    aeu = first('animal_equivalent_units')
+    if aeu:
+        try:
+            farm_data['animal_equivalent_units'] = float(aeu)
+        except ValueError:
+            pass
+    
+    houses = first('estimated_houses')
+    if houses:
+        try:
+            farm_data['estimated_houses'] = int(houses)
+            farm_data['estimated_roof_sqft'] = int(houses) * 25000
+        except ValueError:
+            pass
+    
+    return farm_data
+
+
+def save_import_batch(db, batch: list) -> Tuple[int, int]:
+    """
+    Save a batch of (farm_data, external_id, csv_row) from import_csv.
+    Returns (count_new, count_updated).
+    """
+    farms = [farm_data for farm_data, _, _ in batch]
+    results = db.bulk_upsert_farms(
+        farms,
+        SOURCE_NAME,
+        [external_id for _, external_id, _ in batch],
+        raw_data=[dict(row) for _, _, row in batch]
+    )
+    
+    count_new = 0
+    notes = []
+    for (farm_data, _, row), (farm_id, is_new) in zip(batch, results):
+        # Add notes if present
+        if row.get('notes'):
+            notes.append({'farm_id': farm_id, 'note': row['notes'], 'note_type': 'research'})
+        
+        if is_new:
+            count_new += 1
+            print(f"  NEW: {farm_data['name']}")
+    
+    if notes:
+        db.add_notes(notes)
+    
+    return count_new, len(batch) - count_new
+
+
 def log_activity_interactive():
     """Log an outreach activity for a farm."""
     db = get_db()
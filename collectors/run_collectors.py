@@ -13,6 +13,7 @@ Usage:
 """
 
 import sys
+import itertools
 from datetime import datetime
 
 from db import get_db
@@ -74,28 +75,34 @@ def show_stats():
 
 
 def export_csv(filename: str = 'leads_export.csv'):
-    """Export all leads to CSV."""
+    """Export all leads to CSV, streaming a page of farms at a time."""
     import csv
+    from operator import itemgetter
     
     db = get_db()
+    pages = db.iter_farm_pages()
     
-    # Get all farms via Supabase
-    result = db.client.table('farms').select('*').order('lead_score', desc=True).execute()
-    farms = result.data
-    
-    if not farms:
+    first_page = next(pages, None)
+    if not first_page:
         print("No farms to export")
         return
     
     # Get column names from first record
-    columns = list(farms[0].keys())
+    columns = list(first_page[0].keys())
+    count = 0
+    
+    # Every row has the same columns, so pull values out positionally
+    # instead of letting DictWriter look up and check each key per row
+    row_values = itemgetter(*columns)
     
     with open(filename, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=columns)
-        writer.writeheader()
-        writer.writerows(farms)
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for page in itertools.chain([first_page], pages):
+            writer.writerows(map(row_values, page))
+            count += len(page)
     
-    print(f"Exported {len(farms)} farms to {filename}")
+    print(f"Exported {count} farms to {filename}")
 
 
 def show_top_leads(n: int = 20):
@@ -0,0 +1,11 @@
+-- PA Chicken Farm Lead Database - Lead status counts
+-- Run this in Supabase SQL Editor after 001_schema.sql
+
+-- Count farms per lead status in the database, so callers get one row
+-- per status instead of downloading every farm to tally them
+CREATE OR REPLACE FUNCTION stats_by_status()
+RETURNS TABLE (status TEXT, n BIGINT) AS $$
+    SELECT lead_status, COUNT(*)
+    FROM farms
+    GROUP BY lead_status;
+$$ LANGUAGE sql STABLE;
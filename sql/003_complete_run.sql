@@ -0,0 +1,32 @@
+-- PA Chicken Farm Lead Database - Run completion
+-- Run this in Supabase SQL Editor after 002_stats_by_status.sql
+
+-- Finish a data run and, if it succeeded, stamp its source's
+-- last_successful_run - one round trip and one transaction
+CREATE OR REPLACE FUNCTION complete_run(
+    p_run_id INTEGER,
+    p_records_found INTEGER,
+    p_records_new INTEGER,
+    p_records_updated INTEGER,
+    p_error TEXT DEFAULT NULL
+)
+RETURNS void AS $$
+DECLARE
+    v_source_id INTEGER;
+BEGIN
+    UPDATE data_runs SET
+        completed_at = NOW(),
+        status = CASE WHEN p_error IS NULL THEN 'success' ELSE 'failed' END,
+        records_found = p_records_found,
+        records_new = p_records_new,
+        records_updated = p_records_updated,
+        error_message = p_error
+    WHERE id = p_run_id
+    RETURNING source_id INTO v_source_id;
+    
+    IF p_error IS NULL THEN
+        UPDATE data_sources SET last_successful_run = NOW()
+        WHERE id = v_source_id;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,79 @@
+-- PA Chicken Farm Lead Database - Single-call farm upsert
+-- Run this in Supabase SQL Editor after 003_complete_run.sql
+
+-- Indexes behind upsert_farm's deduplication lookups.
+-- A source's external id identifies one farm; names are only indexed,
+-- since two different farms in a county can share a name.
+CREATE UNIQUE INDEX IF NOT EXISTS idx_farm_sources_source_external
+    ON farm_sources(source_id, external_id);
+CREATE INDEX IF NOT EXISTS idx_farms_name_county ON farms(name, county);
+
+-- Insert or update a farm and link it to a source in one transaction.
+-- Deduplication strategy:
+-- 1. Match by external_id + source
+-- 2. Match by name + county (merging, so nulls don't overwrite good data);
+--    if several farms share them, the oldest (lowest id) wins, as in
+--    LeadDB.bulk_upsert_farms
+-- 3. If no match, insert new (columns missing from farm_data get defaults)
+CREATE OR REPLACE FUNCTION upsert_farm(
+    p_farm_data JSONB,
+    p_source_id INTEGER,
+    p_external_id TEXT,
+    p_raw_data JSONB DEFAULT NULL
+)
+RETURNS TABLE (farm_id INTEGER, is_new BOOLEAN) AS $$
+#variable_conflict use_column
+DECLARE
+    v_farm_id INTEGER;
+    v_is_new BOOLEAN := false;
+    v_data JSONB := p_farm_data;
+    v_columns TEXT;
+BEGIN
+    SELECT fs.farm_id INTO v_farm_id
+    FROM farm_sources fs
+    WHERE fs.source_id = p_source_id AND fs.external_id = p_external_id;
+    
+    IF v_farm_id IS NULL
+       AND NULLIF(p_farm_data->>'name', '') IS NOT NULL
+       AND NULLIF(p_farm_data->>'county', '') IS NOT NULL THEN
+        SELECT f.id INTO v_farm_id
+        FROM farms f
+        WHERE f.name = p_farm_data->>'name' AND f.county = p_farm_data->>'county'
+        ORDER BY f.id
+        LIMIT 1;
+        
+        IF v_farm_id IS NOT NULL THEN
+            v_data := jsonb_strip_nulls(p_farm_data);
+        END IF;
+    END IF;
+    
+    IF v_farm_id IS NULL THEN
+        v_data := p_farm_data || jsonb_build_object('external_id', p_external_id);
+        v_is_new := true;
+    END IF;
+    
+    SELECT string_agg(quote_ident(key), ', ') INTO v_columns
+    FROM jsonb_object_keys(v_data) AS key;
+    
+    IF v_is_new THEN
+        EXECUTE format(
+            'INSERT INTO farms (%1$s) SELECT %1$s FROM jsonb_populate_record(NULL::farms, $1) RETURNING id',
+            v_columns
+        ) INTO v_farm_id USING v_data;
+    ELSIF v_columns IS NOT NULL THEN
+        EXECUTE format(
+            'UPDATE farms SET (%1$s) = (SELECT %1$s FROM jsonb_populate_record(NULL::farms, $1)) WHERE id = $2',
+            v_columns
+        ) USING v_data, v_farm_id;
+    END IF;
+    
+    INSERT INTO farm_sources (farm_id, source_id, external_id, raw_data, last_seen)
+    VALUES (v_farm_id, p_source_id, p_external_id, p_raw_data, NOW())
+    ON CONFLICT (farm_id, source_id) DO UPDATE SET
+        external_id = EXCLUDED.external_id,
+        raw_data = EXCLUDED.raw_data,
+        last_seen = EXCLUDED.last_seen;
+    
+    RETURN QUERY SELECT v_farm_id, v_is_new;
+END;
+$$ LANGUAGE plpgsql;
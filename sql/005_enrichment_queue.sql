@@ -0,0 +1,17 @@
+-- PA Chicken Farm Lead Database - Enrichment queue
+-- Run this in Supabase SQL Editor after 004_upsert_farm.sql
+
+-- Active farms still missing a phone number, with when they were last
+-- contacted, so enrichment gets its work list in one query
+CREATE OR REPLACE VIEW v_farms_enrichment_queue AS
+SELECT
+    f.*,
+    a.last_contact
+FROM farms f
+LEFT JOIN (
+    SELECT farm_id, MAX(performed_at) AS last_contact
+    FROM activities
+    GROUP BY farm_id
+) a ON a.farm_id = f.id
+WHERE f.phone IS NULL
+AND f.is_active = true;